@@ -0,0 +1,102 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, initializedcheck=False
+# distutils: extra_compile_args = -O3 -march=native -fopenmp
+# distutils: extra_link_args = -fopenmp
+"""Compiled point-in-polygon kernel (optional Cython/OpenMP build).
+
+Build in place with `cythonize -i _pip_ext.pyx`; _pip_kernel uses it for the
+candidate kernel when the extension is importable.
+"""
+
+from cython.parallel import prange
+from libc.math cimport isnan
+from libc.stdint cimport int64_t
+
+# Kernel coordinates are float32 or float64 (see polygon_counter.kernel_frame)
+ctypedef fused coord_t:
+    float
+    double
+
+
+cdef inline int _winding(
+    coord_t x, coord_t y,
+    const coord_t[::1] ring_xs, const coord_t[::1] ring_ys,
+    const coord_t[::1] ring_dx, const coord_t[::1] ring_dy,
+    int64_t start, int64_t stop,
+) noexcept nogil:
+    # Same winding test as _pip_kernel._winding
+    cdef int w = 0
+    cdef int64_t i, j
+    cdef coord_t yi, yj, side
+    if stop - start < 3:
+        return 0
+    j = stop - 1
+    for i in range(start, stop):
+        yi = ring_ys[i]
+        yj = ring_ys[j]
+        side = ring_dx[i] * (y - yi) - (x - ring_xs[i]) * ring_dy[i]
+        if yi <= y:
+            if yj > y and side > 0:
+                w += 1
+        elif yj <= y and side < 0:
+            w -= 1
+        j = i
+    return w
+
+
+cdef void _polygon_total(
+    Py_ssize_t q,
+    const coord_t[::1] lons, const coord_t[::1] lats, const double[::1] weights,
+    const int64_t[::1] cand_offsets, const int64_t[::1] cand_ids,
+    const coord_t[::1] ring_xs, const coord_t[::1] ring_ys,
+    const coord_t[::1] ring_dx, const coord_t[::1] ring_dy,
+    const int64_t[::1] ring_offsets, const int64_t[::1] poly_ring_offsets,
+    int64_t[::1] counts, double[::1] weight_sums, int64_t[::1] weight_counts,
+) noexcept nogil:
+    # Totals for polygon q; kept out of the prange body so the accumulators are
+    # plain locals rather than OpenMP reductions
+    cdef int64_t r0 = poly_ring_offsets[q]
+    cdef int64_t r1 = poly_ring_offsets[q + 1]
+    cdef int64_t count = 0, weight_count = 0, k, p, r
+    cdef double weight_sum = 0.0, w
+    cdef coord_t x, y
+    cdef bint inside
+    for k in range(cand_offsets[q], cand_offsets[q + 1]):
+        p = cand_ids[k]
+        x = lons[p]
+        y = lats[p]
+        if _winding(x, y, ring_xs, ring_ys, ring_dx, ring_dy, ring_offsets[r0], ring_offsets[r0 + 1]) == 0:
+            continue
+        inside = True
+        for r in range(r0 + 1, r1):
+            if _winding(x, y, ring_xs, ring_ys, ring_dx, ring_dy, ring_offsets[r], ring_offsets[r + 1]) != 0:
+                inside = False
+                break
+        if not inside:
+            continue
+        count += 1
+        w = weights[p]
+        if not isnan(w):
+            weight_sum += w
+            weight_count += 1
+    counts[q] = count
+    weight_sums[q] = weight_sum
+    weight_counts[q] = weight_count
+
+
+def polygon_totals(
+    const coord_t[::1] lons, const coord_t[::1] lats, const double[::1] weights,
+    const int64_t[::1] cand_offsets, const int64_t[::1] cand_ids,
+    const coord_t[::1] ring_xs, const coord_t[::1] ring_ys,
+    const coord_t[::1] ring_dx, const coord_t[::1] ring_dy,
+    const int64_t[::1] ring_offsets, const int64_t[::1] poly_ring_offsets,
+    int64_t[::1] counts, double[::1] weight_sums, int64_t[::1] weight_counts,
+):
+    # Drop-in for the Numba polygon_totals kernel (same arguments and outputs);
+    # polygons are spread across OpenMP threads with the GIL released
+    cdef Py_ssize_t q
+    for q in prange(cand_offsets.shape[0] - 1, nogil=True, schedule="dynamic"):
+        _polygon_total(
+            q, lons, lats, weights, cand_offsets, cand_ids,
+            ring_xs, ring_ys, ring_dx, ring_dy, ring_offsets, poly_ring_offsets,
+            counts, weight_sums, weight_counts,
+        )
@@ -0,0 +1,199 @@
+"""Compiled point-in-ring kernels (optional Numba, or the Cython _pip_ext build)."""
+
+import contextlib
+import threading
+
+import numpy as np
+
+try:
+    from numba import float32, float64, get_num_threads, int64, njit, prange, threading_layer, void
+except ImportError:  # numba is optional; callers fall back to NumPy
+    njit = None
+    prange = range
+
+    def get_num_threads():
+        return 1
+
+try:
+    from _pip_ext import polygon_totals as ext_polygon_totals
+except ImportError:  # only present once _pip_ext.pyx has been built
+    ext_polygon_totals = None
+
+
+def _winding(x, y, ring_xs, ring_ys, ring_dx, ring_dy, start, stop):
+    # Winding number of (x, y) around vertices start..stop-1 of a ring SoA
+    # (see ring_to_soa); rings with fewer than 3 vertices contain nothing
+    if stop - start < 3:
+        return 0
+    w = 0
+    j = stop - 1
+    for i in range(start, stop):
+        yi = ring_ys[i]
+        yj = ring_ys[j]
+        side = ring_dx[i] * (y - yi) - (x - ring_xs[i]) * ring_dy[i]
+        if yi <= y:
+            if yj > y and side > 0:
+                w += 1
+        elif yj <= y and side < 0:
+            w -= 1
+        j = i
+    return w
+
+
+def _in_polygon(x, y, ring_xs, ring_ys, ring_dx, ring_dy, ring_offsets, r0, r1):
+    # Inside ring r0 (outer) and outside rings r0+1..r1-1 (holes) of a packed ring set
+    if _winding(x, y, ring_xs, ring_ys, ring_dx, ring_dy, ring_offsets[r0], ring_offsets[r0 + 1]) == 0:
+        return False
+    for r in range(r0 + 1, r1):
+        if _winding(x, y, ring_xs, ring_ys, ring_dx, ring_dy, ring_offsets[r], ring_offsets[r + 1]) != 0:
+            return False
+    return True
+
+
+def _polygon_totals(
+    lons, lats, weights,
+    cand_offsets, cand_ids,
+    ring_xs, ring_ys, ring_dx, ring_dy, ring_offsets, poly_ring_offsets,
+    counts, weight_sums, weight_counts,
+):
+    # One polygon per iteration: polygon q tests cand_ids[cand_offsets[q]:cand_offsets[q + 1]]
+    # against its rings poly_ring_offsets[q]..poly_ring_offsets[q + 1] (outer ring first).
+    # Each polygon writes only its own output slot, so prange needs no reduction.
+    for q in prange(cand_offsets.shape[0] - 1):
+        r0 = poly_ring_offsets[q]
+        r1 = poly_ring_offsets[q + 1]
+        count = 0
+        weight_sum = 0.0
+        weight_count = 0
+        for k in range(cand_offsets[q], cand_offsets[q + 1]):
+            p = cand_ids[k]
+            if not _in_polygon(lons[p], lats[p], ring_xs, ring_ys, ring_dx, ring_dy, ring_offsets, r0, r1):
+                continue
+            count += 1
+            w = weights[p]
+            if not np.isnan(w):
+                weight_sum += w
+                weight_count += 1
+        counts[q] = count
+        weight_sums[q] = weight_sum
+        weight_counts[q] = weight_count
+
+
+def _fused_totals(
+    lons, lats, weights, bboxes,
+    ring_xs, ring_ys, ring_dx, ring_dy, ring_offsets, poly_ring_offsets,
+    counts, weight_sums, weight_counts, n_threads,
+):
+    # Single pass over all points: each of n_threads (get_num_threads()) slices
+    # of points walks every polygon, rejecting by bbox (minx, miny, maxx, maxy)
+    # first. Per-thread accumulator rows are summed once at the end.
+    n = lons.shape[0]
+    n_polys = counts.shape[0]
+    local_counts = np.zeros((n_threads, n_polys), dtype=np.int64)
+    local_sums = np.zeros((n_threads, n_polys), dtype=np.float64)
+    local_weight_counts = np.zeros((n_threads, n_polys), dtype=np.int64)
+
+    for t in prange(n_threads):
+        for p in range(t * n // n_threads, (t + 1) * n // n_threads):
+            x = lons[p]
+            y = lats[p]
+            w = weights[p]
+            for q in range(n_polys):
+                if x < bboxes[q, 0] or x > bboxes[q, 2] or y < bboxes[q, 1] or y > bboxes[q, 3]:
+                    continue
+                r0 = poly_ring_offsets[q]
+                r1 = poly_ring_offsets[q + 1]
+                if not _in_polygon(x, y, ring_xs, ring_ys, ring_dx, ring_dy, ring_offsets, r0, r1):
+                    continue
+                local_counts[t, q] += 1
+                if not np.isnan(w):
+                    local_sums[t, q] += w
+                    local_weight_counts[t, q] += 1
+
+    for q in range(n_polys):
+        counts[q] = local_counts[:, q].sum()
+        weight_sums[q] = local_sums[:, q].sum()
+        weight_counts[q] = local_weight_counts[:, q].sum()
+
+
+if njit is not None:
+    # Explicit signatures compile at import time instead of on the first request.
+    # Helpers are rebound first so the kernels below pick up the compiled versions.
+    # Coordinates are float32 or float64 (see kernel_frame); weights and sums stay float64.
+    _winding = njit(cache=True, boundscheck=False, fastmath=True)(_winding)
+    _in_polygon = njit(cache=True, boundscheck=False)(_in_polygon)
+    # No fastmath on the totals kernels: it would let LLVM drop the NaN weight check
+    polygon_totals = njit(
+        [
+            void(
+                coord[:], coord[:], float64[:],
+                int64[:], int64[:],
+                coord[:], coord[:], coord[:], coord[:], int64[:], int64[:],
+                int64[:], float64[:], int64[:],
+            )
+            for coord in (float32, float64)
+        ],
+        cache=True,
+        boundscheck=False,
+        parallel=True,
+    )(_polygon_totals)
+    fused_totals = njit(
+        [
+            void(
+                coord[:], coord[:], float64[:], coord[:, :],
+                coord[:], coord[:], coord[:], coord[:], int64[:], int64[:],
+                int64[:], float64[:], int64[:], int64,
+            )
+            for coord in (float32, float64)
+        ],
+        cache=True,
+        boundscheck=False,
+        parallel=True,
+    )(_fused_totals)
+else:
+    polygon_totals = None
+    fused_totals = None
+
+if ext_polygon_totals is not None:
+    # The prebuilt extension has no JIT cost and runs without Numba installed
+    polygon_totals = ext_polygon_totals
+
+
+# Numba's workqueue threading layer (used when neither TBB nor OpenMP is
+# available) aborts the process if parallel kernels are launched from two
+# threads at once, e.g. overlapping requests in a threaded server
+_workqueue_lock = threading.Lock()
+
+
+def kernel_lock():
+    # Context manager to hold around a kernel call: serializes calls on the
+    # workqueue layer (or before Numba has picked a layer), no-op otherwise
+    if njit is None:
+        return contextlib.nullcontext()
+    try:
+        layer = threading_layer()
+    except ValueError:  # no parallel kernel has run yet
+        return _workqueue_lock
+    return _workqueue_lock if layer == "workqueue" else contextlib.nullcontext()
+
+
+def report_cache():
+    # Kernels are compiled (or loaded) at import; say which, and where the cache lives
+    for kernel in (polygon_totals, fused_totals):
+        if kernel is None:
+            continue
+        if kernel is ext_polygon_totals:
+            print("polygon_totals: prebuilt _pip_ext extension")
+            continue
+        stats = kernel.stats
+        state = "loaded from cache" if stats.cache_hits else "compiled and cached"
+        print(f"{kernel.py_func.__name__}: {state} in {stats.cache_path}")
+
+
+if __name__ == "__main__":
+    # Build step: run `python -m _pip_kernel` once (e.g. in the image build) so
+    # every web worker loads machine code from the cache instead of JIT-compiling;
+    # `python check_kernels.py` then checks the kernels against the NumPy path
+    if njit is None and ext_polygon_totals is None:
+        raise SystemExit("Neither numba nor _pip_ext is installed; the NumPy fallback needs no build step.")
+    report_cache()
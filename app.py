@@ -1,17 +1,24 @@
 #!/usr/bin/env python3
 """Local web app: count CSV points inside KML polygons."""
 
+import atexit
 import csv
+import hashlib
 import io
 import os
+import shutil
 import tempfile
+import threading
 import uuid
-import xml.etree.ElementTree as ET
 import zipfile
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Optional, Tuple
 
+import cachetools
+import numpy as np
+import orjson
 from flask import (
     Flask,
+    Response,
     jsonify,
     redirect,
     render_template,
@@ -20,65 +27,49 @@ from flask import (
     url_for,
 )
 
+from polygon_counter import load_points, parse_kml_polygons, polygon_totals
+
 app = Flask(__name__)
 app.config["MAX_CONTENT_LENGTH"] = 50 * 1024 * 1024  # 50 MB
 
-KML_NS = {"kml": "http://www.opengis.net/kml/2.2"}
-Point = Tuple[float, float]  # (lon, lat)
-Ring = List[Point]
-
-STORE: Dict[str, Dict] = {}
-
-
-def parse_coordinates(text: str) -> Ring:
-    coords: Ring = []
-    if not text:
-        return coords
-    for token in text.strip().split():
-        parts = token.split(",")
-        if len(parts) < 2:
-            continue
-        lon = float(parts[0])
-        lat = float(parts[1])
-        coords.append((lon, lat))
-    return coords
-
-
-def parse_kml_polygons(kml_path: str):
-    tree = ET.parse(kml_path)
-    root = tree.getroot()
-    placemarks = root.findall(".//kml:Placemark", KML_NS)
-    polygons = []
-
-    for pm in placemarks:
-        name = pm.findtext("kml:name", default="(unnamed)", namespaces=KML_NS)
-        poly = pm.find(".//kml:Polygon", KML_NS)
-        if poly is None:
-            continue
-
-        outer = poly.find(".//kml:outerBoundaryIs//kml:LinearRing//kml:coordinates", KML_NS)
-        outer_coords = parse_coordinates(outer.text if outer is not None else "")
-        if not outer_coords:
-            continue
-
-        holes = []
-        for inner in poly.findall(".//kml:innerBoundaryIs//kml:LinearRing//kml:coordinates", KML_NS):
-            ring = parse_coordinates(inner.text or "")
-            if ring:
-                holes.append(ring)
-
-        lons = [p[0] for p in outer_coords]
-        lats = [p[1] for p in outer_coords]
-        bbox = (min(lons), min(lats), max(lons), max(lats))
-
-        polygons.append({
-            "name": name,
-            "outer": outer_coords,
-            "holes": holes,
-            "bbox": bbox,
-        })
 
-    return polygons
+class RunStore(cachetools.LRUCache):
+    # Evicted runs take their temp workdir (uploads, spilled point arrays) with them
+    def popitem(self):
+        run_id, data = super().popitem()
+        shutil.rmtree(data["workdir"], ignore_errors=True)
+        return run_id, data
+
+
+# Most recent runs only; LRUCache is not thread-safe, so access goes through STORE_LOCK
+STORE = RunStore(maxsize=32)
+STORE_LOCK = threading.Lock()
+
+
+@atexit.register
+def remove_runs():
+    # Stored runs' workdirs are otherwise only removed on eviction
+    with STORE_LOCK:
+        for data in STORE.values():
+            shutil.rmtree(data["workdir"], ignore_errors=True)
+
+
+class PointCache(cachetools.LRUCache):
+    # Evicted entries take their spilled point array with them
+    def popitem(self):
+        key, path = super().popitem()
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return key, path
+
+
+# Parsed points of recent CSV uploads, keyed by points_key(); values are .npy
+# paths in POINT_CACHE_DIR, linked into each run's workdir (see restore_points)
+POINT_CACHE = PointCache(maxsize=8)
+POINT_CACHE_LOCK = threading.Lock()
+POINT_CACHE_DIR = None  # created on first use, see point_cache_dir()
 
 
 def extract_kml_from_kmz(kmz_path: str, workdir: str) -> str:
@@ -94,81 +85,12 @@ def extract_kml_from_kmz(kmz_path: str, workdir: str) -> str:
     return out_path
 
 
-def point_in_ring(point: Point, ring: Ring) -> bool:
-    x, y = point
-    inside = False
-    n = len(ring)
-    if n < 3:
-        return False
-
-    j = n - 1
-    for i in range(n):
-        xi, yi = ring[i]
-        xj, yj = ring[j]
-        intersect = ((yi > y) != (yj > y)) and (
-            x < (xj - xi) * (y - yi) / (yj - yi + 1e-16) + xi
-        )
-        if intersect:
-            inside = not inside
-        j = i
-
-    return inside
-
-
-def point_in_polygon(point: Point, outer: Ring, holes: List[Ring]) -> bool:
-    if not point_in_ring(point, outer):
-        return False
-    for hole in holes:
-        if point_in_ring(point, hole):
-            return False
-    return True
-
-
-def parse_float(value: Optional[str]) -> Optional[float]:
-    if value is None:
-        return None
-    s = value.strip()
-    if not s:
-        return None
-    if s.endswith("%"):
-        s = s[:-1]
-    try:
-        return float(s)
-    except ValueError:
-        return None
-
-
-def load_points(csv_path: str, lat_col: str, lon_col: str, weight_col: Optional[str]):
-    points = []
-    with open(csv_path, "r", encoding="utf-8", errors="replace") as f:
-        reader = csv.DictReader(f)
-        if not reader.fieldnames:
-            raise ValueError("CSV has no header row.")
-
-        field_map = {name.strip().lstrip("\ufeff").lower(): name for name in reader.fieldnames}
-        lat_key = field_map.get(lat_col.lower())
-        lon_key = field_map.get(lon_col.lower())
-        weight_key = field_map.get(weight_col.lower()) if weight_col else None
-
-        if not lat_key or not lon_key:
-            raise ValueError(f"CSV missing columns. Found: {reader.fieldnames}")
-
-        for row in reader:
-            lat = parse_float(row.get(lat_key))
-            lon = parse_float(row.get(lon_key))
-            if lat is None or lon is None:
-                continue
-            weight = parse_float(row.get(weight_key)) if weight_key else None
-            points.append((lon, lat, weight))
-
-    return points
-
-
 def polygons_to_geojson(polygons):
     features = []
     for poly in polygons:
         rings = [poly["outer"]] + poly["holes"]
-        coords = [[[lon, lat] for lon, lat in ring] for ring in rings]
+        # Kept as ndarrays; orjson serializes them directly (must be C-contiguous)
+        coords = [np.ascontiguousarray(ring) for ring in rings]
         features.append({
             "type": "Feature",
             "properties": {"name": poly["name"]},
@@ -186,6 +108,84 @@ def write_results_csv(results) -> io.StringIO:
     return output
 
 
+def run_geojson(data) -> Dict:
+    # Memoized per run
+    if "polygons_geojson" not in data:
+        data["polygons_geojson"] = polygons_to_geojson(data["polygons"])
+    return data["polygons_geojson"]
+
+
+def run_csv(data) -> str:
+    # Memoized per run
+    if "results_csv" not in data:
+        data["results_csv"] = write_results_csv(data["results"]).getvalue()
+    return data["results_csv"]
+
+
+def get_run(run_id: str) -> Optional[Dict]:
+    with STORE_LOCK:
+        return STORE.get(run_id)
+
+
+def get_run_points(run_id: str) -> Tuple[Optional[Dict], Optional[np.ndarray]]:
+    # Run entry and its (3, N) lons/lats/weights, memory-mapped from the run's
+    # workdir. The map is opened under STORE_LOCK so a concurrent eviction can't
+    # remove the file in between; once open it stays readable.
+    with STORE_LOCK:
+        data = STORE.get(run_id)
+        if data is None:
+            return None, None
+        return data, np.load(data["points_path"], mmap_mode="r")
+
+
+def points_key(stream, lat_col: str, lon_col: str, weight_col: Optional[str]) -> str:
+    # BLAKE2b of the column selection and the upload's bytes, read in chunks;
+    # the stream is rewound so the upload can still be saved
+    digest = hashlib.blake2b(orjson.dumps([lat_col, lon_col, weight_col]), digest_size=20)
+    for chunk in iter(lambda: stream.read(1 << 20), b""):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def link_or_copy(src: str, dst: str):
+    # Hard link where the filesystem allows it, so cache and run share one file
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def point_cache_dir() -> str:
+    # Temp dir for POINT_CACHE, made on the first cached upload (callers hold
+    # POINT_CACHE_LOCK) and removed with whatever it still holds at exit
+    global POINT_CACHE_DIR
+    if POINT_CACHE_DIR is None:
+        POINT_CACHE_DIR = tempfile.mkdtemp(prefix="kml_points_")
+        atexit.register(shutil.rmtree, POINT_CACHE_DIR, ignore_errors=True)
+    return POINT_CACHE_DIR
+
+
+def restore_points(key: str, points_path: str) -> bool:
+    # Put points parsed earlier from the same CSV and columns at points_path
+    with POINT_CACHE_LOCK:
+        cached = POINT_CACHE.get(key)
+        if cached is None:
+            return False
+        link_or_copy(cached, points_path)
+    return True
+
+
+def remember_points(key: str, points_path: str):
+    # Share a freshly parsed run's points with later uploads of the same CSV
+    with POINT_CACHE_LOCK:
+        if key in POINT_CACHE:
+            return
+        cached = os.path.join(point_cache_dir(), f"{key}.npy")
+        link_or_copy(points_path, cached)
+        POINT_CACHE[key] = cached
+
+
 @app.get("/")
 def index():
     return render_template("index.html")
@@ -202,71 +202,80 @@ def process():
     if not kml_file or not csv_file:
         return render_template("index.html", error="Please upload both KML and CSV files."), 400
 
+    csv_key = points_key(csv_file.stream, lat_col, lon_col, weight_col)
+
     run_id = str(uuid.uuid4())
     workdir = tempfile.mkdtemp(prefix="kml_count_")
-    kml_path = os.path.join(workdir, "polygons.kml")
-    csv_path = os.path.join(workdir, "points.csv")
-    kml_file.save(kml_path)
-    csv_file.save(csv_path)
-
-    kml_source = kml_path
-    if kml_file.filename and kml_file.filename.lower().endswith(".kmz"):
-        kml_source = extract_kml_from_kmz(kml_path, workdir)
-
-    polygons = parse_kml_polygons(kml_source)
-    if not polygons:
-        return render_template("index.html", error="No polygons found in KML."), 400
-
-    points = load_points(csv_path, lat_col, lon_col, weight_col)
-    if not points:
-        return render_template("index.html", error="No valid points found in CSV."), 400
-
-    results = []
-    for poly in polygons:
-        minx, miny, maxx, maxy = poly["bbox"]
-        count = 0
-        weight_sum = 0.0
-
-        for lon, lat, weight in points:
-            if lon < minx or lon > maxx or lat < miny or lat > maxy:
-                continue
-            if point_in_polygon((lon, lat), poly["outer"], poly["holes"]):
-                count += 1
-                if weight is not None:
-                    weight_sum += weight
-
-        results.append({
-            "polygon": poly["name"],
-            "count": count,
-            "weight_sum": round(weight_sum, 6),
-        })
-
-    total_weight = sum(r["weight_sum"] for r in results) or 0.0
-    for r in results:
-        r["weight_percent"] = round((r["weight_sum"] / total_weight) * 100, 2) if total_weight else 0.0
-
-    results.sort(key=lambda r: r["weight_sum"], reverse=True)
-
-    weights = [w for _, _, w in points if w is not None]
-    weight_min = min(weights) if weights else 0.0
-    weight_max = max(weights) if weights else 0.0
-
-    STORE[run_id] = {
-        "results": results,
-        "results_csv": write_results_csv(results).getvalue(),
-        "polygons_geojson": polygons_to_geojson(polygons),
-        "points": points,
-        "weight_min": weight_min,
-        "weight_max": weight_max,
-        "point_count": len(points),
-    }
+    stored = False
+    try:
+        kml_path = os.path.join(workdir, "polygons.kml")
+        csv_path = os.path.join(workdir, "points.csv")
+        kml_file.save(kml_path)
+
+        kml_source = kml_path
+        if kml_file.filename and kml_file.filename.lower().endswith(".kmz"):
+            kml_source = extract_kml_from_kmz(kml_path, workdir)
+
+        polygons = parse_kml_polygons(kml_source)
+        if not polygons:
+            return render_template("index.html", error="No polygons found in KML."), 400
+
+        # Points are spilled to disk and shared with later runs over the same CSV;
+        # GeoJSON and the results CSV are built on first request (see run_geojson/run_csv)
+        points_path = os.path.join(workdir, "points.npy")
+        if restore_points(csv_key, points_path):
+            lons, lats, weights = np.load(points_path, mmap_mode="r")
+        else:
+            csv_file.save(csv_path)
+            lons, lats, weights = load_points(csv_path, lat_col, lon_col, weight_col)
+            if lons.size == 0:
+                return render_template("index.html", error="No valid points found in CSV."), 400
+            np.save(points_path, np.vstack((lons, lats, weights)))
+            remember_points(csv_key, points_path)
+
+        counts, weight_sums, _ = polygon_totals(polygons, lons, lats, weights)
+
+        results = []
+        for i, poly in enumerate(polygons):
+            results.append({
+                "polygon": poly["name"],
+                "count": int(counts[i]),
+                "weight_sum": round(float(weight_sums[i]), 6),
+            })
+
+        total_weight = sum(r["weight_sum"] for r in results) or 0.0
+        for r in results:
+            r["weight_percent"] = round((r["weight_sum"] / total_weight) * 100, 2) if total_weight else 0.0
+
+        results.sort(key=lambda r: r["weight_sum"], reverse=True)
+
+        valid_weights = weights[~np.isnan(weights)]
+        weight_min = float(valid_weights.min()) if valid_weights.size else 0.0
+        weight_max = float(valid_weights.max()) if valid_weights.size else 0.0
+
+        with STORE_LOCK:
+            STORE[run_id] = {
+                "workdir": workdir,
+                "results": results,
+                "polygons": [{"name": p["name"], "outer": p["outer"], "holes": p["holes"]} for p in polygons],
+                "points_path": points_path,
+                "weight_min": weight_min,
+                "weight_max": weight_max,
+                "point_count": int(lons.size),
+            }
+        stored = True
+    finally:
+        # Runs that are not stored (bad input, parse errors) never get evicted,
+        # so their uploads are removed here
+        if not stored:
+            shutil.rmtree(workdir, ignore_errors=True)
 
     return redirect(url_for("results", run_id=run_id))
 
 
 @app.get("/results/<run_id>")
 def results(run_id: str):
-    data = STORE.get(run_id)
+    data = get_run(run_id)
     if not data:
         return render_template("index.html", error="Results not found. Please re-run."), 404
     return render_template(
@@ -279,33 +288,30 @@ def results(run_id: str):
 
 @app.get("/results/<run_id>/data")
 def results_data(run_id: str):
-    data = STORE.get(run_id)
+    data, points = get_run_points(run_id)
     if not data:
         return jsonify({"error": "not found"}), 404
 
     # Leaflet.heat expects [lat, lon, intensity]
-    heat_points = []
-    for lon, lat, weight in data["points"]:
-        if weight is None:
-            heat_points.append([lat, lon, 0.0])
-        else:
-            heat_points.append([lat, lon, weight])
+    lons, lats, weights = points
+    heat_points = np.stack((lats, lons, np.nan_to_num(weights, nan=0.0)), axis=1)
 
-    return jsonify({
-        "polygons": data["polygons_geojson"],
+    payload = {
+        "polygons": run_geojson(data),
         "points": heat_points,
         "weight_min": data["weight_min"],
         "weight_max": data["weight_max"],
-    })
+    }
+    return Response(orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY), mimetype="application/json")
 
 
 @app.get("/download/<run_id>.csv")
 def download(run_id: str):
-    data = STORE.get(run_id)
+    data = get_run(run_id)
     if not data:
         return render_template("index.html", error="Results not found. Please re-run."), 404
     return send_file(
-        io.BytesIO(data["results_csv"].encode("utf-8")),
+        io.BytesIO(run_csv(data).encode("utf-8")),
         mimetype="text/csv",
         as_attachment=True,
         download_name="polygon_counts.csv",
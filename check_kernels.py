@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Check the compiled PIP kernels against the NumPy path (run after python -m _pip_kernel)."""
+
+import numpy as np
+
+from polygon_counter import (
+    KERNEL_FLOAT32_MAX_ULP,
+    bbox_matrix,
+    fused_totals_jit,
+    kernel_frame,
+    kernel_totals,
+    pair_totals,
+    polygon_record,
+    polygon_totals_jit,
+)
+
+
+def square(cx: float, cy: float, half: float):
+    return np.array([[cx - half, cy - half], [cx + half, cy - half], [cx + half, cy + half],
+                     [cx - half, cy + half], [cx - half, cy - half]])
+
+
+def spread_cases(points_per_polygon: int):
+    # About 220 m squares with a 110 m square hole, close together (float32
+    # frame) and spread across the globe (float64 frame). Points closer to an
+    # edge than KERNEL_FLOAT32_MAX_ULP are left out: float32 may round those
+    # either way.
+    rng = np.random.default_rng(0)
+    half = 0.001
+    for centers in ([0.0, 0.01], [0.0, 10.0], [-170.0, 170.0]):
+        polygons = []
+        lons = []
+        lats = []
+        for cx in centers:
+            polygons.append(polygon_record(f"lon {cx}", square(cx, 45.0, half), [square(cx, 45.0, half / 2)]))
+            edges_x = cx + np.array([-half, -half / 2, half / 2, half])
+            edges_y = 45.0 + np.array([-half, -half / 2, half / 2, half])
+            x = rng.uniform(cx - 1.2 * half, cx + 1.2 * half, points_per_polygon)
+            y = rng.uniform(45 - 1.2 * half, 45 + 1.2 * half, points_per_polygon)
+            clear = (
+                (np.abs(x[:, None] - edges_x).min(axis=1) > KERNEL_FLOAT32_MAX_ULP)
+                & (np.abs(y[:, None] - edges_y).min(axis=1) > KERNEL_FLOAT32_MAX_ULP)
+            )
+            lons.append(x[clear])
+            lats.append(y[clear])
+        lons = np.concatenate(lons)
+        lats = np.concatenate(lats)
+        weights = rng.uniform(0, 100, lons.size)
+        weights[rng.random(lons.size) < 0.1] = np.nan
+        yield f"lons {centers}", polygons, lons, lats, weights
+
+
+def edge_case():
+    # Integer grid over a square with a hole and a triangle: many points sit
+    # exactly on edges and vertices, where every path must apply the same
+    # half-open rule
+    polygons = [
+        polygon_record("square", square(5.0, 5.0, 5.0), [square(5.0, 5.0, 2.0)]),
+        polygon_record("triangle", np.array([[0.0, 0.0], [10.0, 0.0], [0.0, 10.0], [0.0, 0.0]]), []),
+    ]
+    lons, lats = (axis.ravel() for axis in np.meshgrid(np.arange(11.0), np.arange(11.0)))
+    weights = np.arange(lons.size, dtype=np.float64)
+    yield "integer grid", polygons, lons, lats, weights
+
+
+def main():
+    if polygon_totals_jit is None:
+        raise SystemExit("No compiled kernels installed; nothing to check.")
+
+    failed = False
+    cases = list(spread_cases(50_000)) + list(edge_case())
+    for label, polygons, lons, lats, weights in cases:
+        expected = pair_totals(polygons, lons, lats, weights)
+        frame = kernel_frame(bbox_matrix(polygons))[1].__name__
+        for fused in (True, False) if fused_totals_jit is not None else (False,):
+            counts, weight_sums, weight_counts = kernel_totals(polygons, lons, lats, weights, fused)
+            kernel = "fused" if fused else "candidates"
+            ok = (
+                np.array_equal(counts, expected[0])
+                and np.array_equal(weight_counts, expected[2])
+                and np.allclose(weight_sums, expected[1], rtol=1e-9)
+            )
+            print(f"{'ok  ' if ok else 'FAIL'} {kernel} kernel ({frame}), {label}: "
+                  f"{counts.tolist()} vs {expected[0].tolist()}")
+            failed |= not ok
+
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,461 @@
+"""Shared KML/CSV parsing and point-in-polygon counting for app.py and the CLI."""
+
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from lxml import etree
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pv
+except ImportError:  # pyarrow is optional; fall back to the pandas C parser
+    pa = None
+
+from _pip_kernel import fused_totals as fused_totals_jit
+from _pip_kernel import get_num_threads
+from _pip_kernel import kernel_lock
+from _pip_kernel import polygon_totals as polygon_totals_jit
+
+KML_NS = {"kml": "http://www.opengis.net/kml/2.2"}
+Ring = np.ndarray  # (N, 2) array of (lon, lat)
+
+# Upper bound on (points x edges) cells materialized per vectorized PIP batch,
+# also used for the dense (polygons x points) bbox mask
+PIP_CHUNK_SIZE = 1 << 22
+
+# Up to this many polygons the fused kernel's per-point bbox scan is cheaper
+# than building a spatial index
+FUSED_MAX_POLYGONS = 256
+
+# Largest float32 spacing (in degrees, about 1 cm) accepted for the compiled
+# kernels' coordinates; polygon sets spread wider than that run in float64
+KERNEL_FLOAT32_MAX_ULP = 1e-7
+
+
+def parse_coordinates(text: str) -> Ring:
+    if not text:
+        return np.empty((0, 2), dtype=np.float64)
+    tokens = text.split()
+
+    # Fast path: every tuple is lon,lat,alt or every tuple is lon,lat
+    width = tokens[0].count(",") + 1 if tokens else 0
+    if width in (2, 3) and all(token.count(",") == width - 1 for token in tokens):
+        try:
+            values = np.array(text.replace(",", " ").split(), dtype=np.float64)
+        except ValueError:
+            values = None
+        if values is not None and values.size == width * len(tokens):
+            return values.reshape(-1, width)[:, :2]
+
+    coords = []
+    for token in tokens:
+        parts = token.split(",")
+        if len(parts) < 2:
+            continue
+        lon = float(parts[0])
+        lat = float(parts[1])
+        coords.append((lon, lat))
+    return np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+
+
+def placemark_to_polygon(pm):
+    name = pm.findtext("kml:name", default="(unnamed)", namespaces=KML_NS)
+    poly = pm.find(".//kml:Polygon", KML_NS)
+    if poly is None:
+        return None
+
+    outer = poly.find(".//kml:outerBoundaryIs//kml:LinearRing//kml:coordinates", KML_NS)
+    outer_coords = parse_coordinates(outer.text if outer is not None else "")
+    if len(outer_coords) == 0:
+        return None
+
+    holes = []
+    for inner in poly.findall(".//kml:innerBoundaryIs//kml:LinearRing//kml:coordinates", KML_NS):
+        ring = parse_coordinates(inner.text or "")
+        if len(ring):
+            holes.append(ring)
+
+    return polygon_record(name, outer_coords, holes)
+
+
+def polygon_record(name: str, outer: Ring, holes: List[Ring]):
+    minx, miny = outer.min(axis=0)
+    maxx, maxy = outer.max(axis=0)
+    bbox = (float(minx), float(miny), float(maxx), float(maxy))
+
+    return {
+        "name": name,
+        "outer": outer,
+        "holes": holes,
+        "bbox": bbox,
+        "outer_soa": ring_to_soa(outer),
+        "holes_soa": [ring_to_soa(h) for h in holes],
+    }
+
+
+def parse_kml_polygons(kml_path: str):
+    # Stream Placemarks instead of building the whole DOM
+    context = etree.iterparse(
+        kml_path,
+        events=("end",),
+        tag="{%s}Placemark" % KML_NS["kml"],
+        huge_tree=True,  # long coordinate strings exceed libxml2's default text limit
+        resolve_entities=False,
+    )
+    polygons = []
+
+    for _, pm in context:
+        polygon = placemark_to_polygon(pm)
+        if polygon is not None:
+            polygons.append(polygon)
+
+        # Free this placemark and everything already processed before it
+        pm.clear()
+        while pm.getprevious() is not None:
+            del pm.getparent()[0]
+
+    return polygons
+
+
+def point_in_ring_wn(
+    xs: np.ndarray,
+    ys: np.ndarray,
+    ring_xs: np.ndarray,
+    ring_ys: np.ndarray,
+    ring_dx: np.ndarray,
+    ring_dy: np.ndarray,
+) -> np.ndarray:
+    # Vectorized winding number over a batch of points; returns a boolean mask.
+    # Edges crossing the point's row upward/downward add +1/-1 when the point
+    # lies on the matching side, so no division (or epsilon) is needed.
+    if ring_xs.size < 3 or xs.size == 0:
+        return np.zeros(xs.shape, dtype=bool)
+
+    xi = ring_xs
+    yi = ring_ys
+    yj = np.roll(ring_ys, 1)
+
+    inside = np.empty(xs.shape, dtype=bool)
+    step = max(1, PIP_CHUNK_SIZE // ring_xs.size)
+    for start in range(0, xs.size, step):
+        x = xs[start:start + step, None]
+        y = ys[start:start + step, None]
+        side = ring_dx * (y - yi) - (x - xi) * ring_dy
+        up = (yi <= y) & (yj > y) & (side > 0)
+        down = (yi > y) & (yj <= y) & (side < 0)
+        winding = np.count_nonzero(up, axis=1) - np.count_nonzero(down, axis=1)
+        inside[start:start + step] = winding != 0
+    return inside
+
+
+def ring_to_soa(ring: Ring) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # (xs, ys, dx, dy) where edge i runs from vertex i to vertex i-1
+    arr = np.asarray(ring, dtype=np.float64).reshape(-1, 2)
+    xs = np.ascontiguousarray(arr[:, 0])
+    ys = np.ascontiguousarray(arr[:, 1])
+    dx = np.roll(xs, 1) - xs
+    dy = np.roll(ys, 1) - ys
+    return xs, ys, dx, dy
+
+
+def point_in_polygon_vec(xs: np.ndarray, ys: np.ndarray, outer_soa, holes_soa) -> np.ndarray:
+    inside = point_in_ring_wn(xs, ys, *outer_soa)
+    for hole_soa in holes_soa:
+        if not inside.any():
+            break
+        idx = np.flatnonzero(inside)
+        inside[idx[point_in_ring_wn(xs[idx], ys[idx], *hole_soa)]] = False
+    return inside
+
+
+def build_point_grid(lons: np.ndarray, lats: np.ndarray):
+    # Uniform grid over the point extent, about one point per cell; points are
+    # sorted by linearized cell id so each cell is a contiguous slice of "order"
+    finite = np.isfinite(lons) & np.isfinite(lats)
+    if not finite.any():
+        return None
+    minx, maxx = float(lons[finite].min()), float(lons[finite].max())
+    miny, maxy = float(lats[finite].min()), float(lats[finite].max())
+    area = (maxx - minx) * (maxy - miny)
+    cell = float(np.sqrt(area / lons.size)) if area > 0 else 0.0
+    # Flat or nearly flat extents would give a tiny cell along the long side;
+    # keep each side at most N cells so the grid stays O(N)
+    cell = max(cell, (maxx - minx) / lons.size, (maxy - miny) / lons.size) or 1.0
+    nx = int((maxx - minx) // cell) + 1
+    ny = int((maxy - miny) // cell) + 1
+
+    with np.errstate(invalid="ignore"):
+        cx = np.clip(np.nan_to_num(np.floor_divide(lons - minx, cell)), 0, nx - 1).astype(np.int64)
+        cy = np.clip(np.nan_to_num(np.floor_divide(lats - miny, cell)), 0, ny - 1).astype(np.int64)
+    cell_ids = cy * nx + cx
+    order = np.argsort(cell_ids, kind="stable")
+    offsets = np.searchsorted(cell_ids[order], np.arange(nx * ny + 1))
+    return {
+        "origin": (minx, miny),
+        "cell": cell,
+        "shape": (nx, ny),
+        "order": order,
+        "offsets": offsets,
+    }
+
+
+def grid_candidates(grid, bbox, lons: np.ndarray, lats: np.ndarray) -> np.ndarray:
+    # Point indices in the grid cells overlapping bbox, trimmed to the bbox itself
+    minx, miny, maxx, maxy = bbox
+    ox, oy = grid["origin"]
+    cell = grid["cell"]
+    nx, ny = grid["shape"]
+    cx0 = max(int((minx - ox) // cell), 0)
+    cx1 = min(int((maxx - ox) // cell), nx - 1)
+    cy0 = max(int((miny - oy) // cell), 0)
+    cy1 = min(int((maxy - oy) // cell), ny - 1)
+    if cx0 > cx1 or cy0 > cy1:
+        return np.empty(0, dtype=np.int64)
+
+    # Cells cx0..cx1 of one row are adjacent in "order", so each row is one slice
+    offsets = grid["offsets"]
+    idx = np.sort(np.concatenate([
+        grid["order"][offsets[cy * nx + cx0]:offsets[cy * nx + cx1 + 1]]
+        for cy in range(cy0, cy1 + 1)
+    ]))
+    sub_lons = lons[idx]
+    sub_lats = lats[idx]
+    return idx[(sub_lons >= minx) & (sub_lons <= maxx) & (sub_lats >= miny) & (sub_lats <= maxy)]
+
+
+def bbox_matrix(polygons) -> np.ndarray:
+    # Contiguous (P, 4) array of (minx, miny, maxx, maxy)
+    return np.array([poly["bbox"] for poly in polygons], dtype=np.float64).reshape(-1, 4)
+
+
+def bbox_mask_candidates(bboxes: np.ndarray, lons: np.ndarray, lats: np.ndarray) -> List[np.ndarray]:
+    # All points against all bboxes in one broadcast; row j is polygon j's mask
+    in_bbox = (
+        (lons >= bboxes[:, 0, None])
+        & (lons <= bboxes[:, 2, None])
+        & (lats >= bboxes[:, 1, None])
+        & (lats <= bboxes[:, 3, None])
+    )
+    return [np.flatnonzero(row) for row in in_bbox]
+
+
+def bbox_candidates(polygons, lons: np.ndarray, lats: np.ndarray) -> List[np.ndarray]:
+    # Per-polygon candidate point indices: a dense (P, N) bbox mask when that is
+    # small, otherwise a uniform grid hash of the points
+    if len(polygons) * lons.size <= PIP_CHUNK_SIZE:
+        return bbox_mask_candidates(bbox_matrix(polygons), lons, lats)
+    grid = build_point_grid(lons, lats)
+    if grid is None:
+        return [np.empty(0, dtype=np.int64) for _ in polygons]
+    return [grid_candidates(grid, poly["bbox"], lons, lats) for poly in polygons]
+
+
+def select_points_in_polygon(
+    poly, lons: np.ndarray, lats: np.ndarray, candidates: Optional[np.ndarray] = None
+) -> np.ndarray:
+    # Indices of points inside poly: bbox prefilter, then vectorized PIP on the survivors
+    if candidates is None:
+        minx, miny, maxx, maxy = poly["bbox"]
+        mask = (lons >= minx) & (lons <= maxx) & (lats >= miny) & (lats <= maxy)
+        idx = np.flatnonzero(mask)
+    else:
+        idx = candidates
+    return idx[point_in_polygon_vec(lons[idx], lats[idx], poly["outer_soa"], poly["holes_soa"])]
+
+
+def polygon_point_pairs(polygons, lons: np.ndarray, lats: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # (polygon index, point index) for every point inside a polygon
+    candidates = bbox_candidates(polygons, lons, lats)
+    point_ids = [select_points_in_polygon(poly, lons, lats, candidates[i]) for i, poly in enumerate(polygons)]
+    poly_ids = np.repeat(np.arange(len(polygons)), [ids.size for ids in point_ids])
+    return poly_ids, np.concatenate(point_ids)
+
+
+def kernel_frame(bboxes: np.ndarray):
+    # (origin, dtype) for the compiled kernels' coordinates. float32 relative to
+    # the center of all polygon bboxes when its spacing at the farthest bbox edge
+    # is within KERNEL_FLOAT32_MAX_ULP (points that can land inside a polygon are
+    # no farther out); otherwise unshifted float64, as in polygon_point_pairs
+    ox = float(bboxes[:, 0].min() + bboxes[:, 2].max()) / 2
+    oy = float(bboxes[:, 1].min() + bboxes[:, 3].max()) / 2
+    reach = float(np.abs(bboxes - np.array([ox, oy, ox, oy])).max(initial=0.0))
+    if np.spacing(np.float32(reach)) <= KERNEL_FLOAT32_MAX_ULP:
+        return (ox, oy), np.float32
+    return (0.0, 0.0), np.float64
+
+
+def to_kernel_coords(values: np.ndarray, offset, dtype) -> np.ndarray:
+    return np.ascontiguousarray(values - offset, dtype=dtype)
+
+
+def pack_rings(polygons, origin: Tuple[float, float], dtype):
+    # CSR layout of every ring: concatenated (xs, ys, dx, dy) columns relative
+    # to origin, ring start offsets, and per-polygon ring ranges with the outer
+    # ring first
+    rings = [ring for poly in polygons for ring in [poly["outer_soa"]] + poly["holes_soa"]]
+    ring_offsets = np.zeros(len(rings) + 1, dtype=np.int64)
+    np.cumsum([ring[0].size for ring in rings], out=ring_offsets[1:])
+    poly_ring_offsets = np.zeros(len(polygons) + 1, dtype=np.int64)
+    np.cumsum([1 + len(poly["holes_soa"]) for poly in polygons], out=poly_ring_offsets[1:])
+    ox, oy = origin
+    columns = [
+        to_kernel_coords(np.concatenate([ring[0] for ring in rings]), ox, dtype),
+        to_kernel_coords(np.concatenate([ring[1] for ring in rings]), oy, dtype),
+        to_kernel_coords(np.concatenate([ring[2] for ring in rings]), 0.0, dtype),
+        to_kernel_coords(np.concatenate([ring[3] for ring in rings]), 0.0, dtype),
+    ]
+    return (*columns, ring_offsets, poly_ring_offsets)
+
+
+def spread_bits(v: np.ndarray) -> np.ndarray:
+    # Spread the low 16 bits of v so bit i moves to bit 2i
+    v = v.astype(np.uint32) & 0x0000FFFF
+    v = (v | (v << 8)) & 0x00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F
+    v = (v | (v << 2)) & 0x33333333
+    v = (v | (v << 1)) & 0x55555555
+    return v
+
+
+def morton_order(lons: np.ndarray, lats: np.ndarray) -> np.ndarray:
+    # Permutation sorting points along a Z-order curve over their extent, so
+    # spatially close points are also close in memory
+    finite = np.isfinite(lons) & np.isfinite(lats)
+    if not finite.any():
+        return np.arange(lons.size)
+    keys = []
+    for values in (lons, lats):
+        lo = values[finite].min()
+        hi = values[finite].max()
+        scale = 65535.0 / (hi - lo) if hi > lo else 0.0
+        with np.errstate(invalid="ignore"):
+            keys.append(np.clip(np.nan_to_num((values - lo) * scale), 0, 65535))
+    morton = spread_bits(keys[0]) | (spread_bits(keys[1]) << 1)
+    return np.argsort(morton, kind="stable")
+
+
+def kernel_totals(polygons, lons: np.ndarray, lats: np.ndarray, weights: np.ndarray, fused: bool):
+    # Totals from the compiled kernels: the fused pass over all points, or the
+    # per-polygon kernel over indexed candidates
+    n = len(polygons)
+    bboxes = bbox_matrix(polygons)
+    origin, dtype = kernel_frame(bboxes)
+    ox, oy = origin
+    xs = to_kernel_coords(lons, ox, dtype)
+    ys = to_kernel_coords(lats, oy, dtype)
+    rings = pack_rings(polygons, origin, dtype)
+    counts = np.zeros(n, dtype=np.int64)
+    weight_sums = np.zeros(n, dtype=np.float64)
+    weight_counts = np.zeros(n, dtype=np.int64)
+
+    if fused:
+        # (v - origin) is monotonic, so bbox comparisons are unaffected
+        kernel_bboxes = to_kernel_coords(bboxes, np.array([ox, oy, ox, oy]), dtype)
+        with kernel_lock():
+            fused_totals_jit(
+                xs, ys, weights, kernel_bboxes, *rings,
+                counts, weight_sums, weight_counts, get_num_threads(),
+            )
+        return counts, weight_sums, weight_counts
+
+    candidates = bbox_candidates(polygons, lons, lats)
+    cand_offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum([ids.size for ids in candidates], out=cand_offsets[1:])
+    cand_ids = np.concatenate(candidates).astype(np.int64)
+    with kernel_lock():
+        polygon_totals_jit(
+            xs, ys, weights, cand_offsets, cand_ids, *rings,
+            counts, weight_sums, weight_counts,
+        )
+    return counts, weight_sums, weight_counts
+
+
+def pair_totals(polygons, lons: np.ndarray, lats: np.ndarray, weights: np.ndarray):
+    # Totals from the (polygon, point) pairs of the NumPy path
+    n = len(polygons)
+    poly_ids, point_ids = polygon_point_pairs(polygons, lons, lats)
+    inside_weights = weights[point_ids]
+    counts = np.bincount(poly_ids, minlength=n)
+    weight_sums = np.bincount(poly_ids, weights=np.nan_to_num(inside_weights), minlength=n)
+    weight_counts = np.bincount(poly_ids[~np.isnan(inside_weights)], minlength=n)
+    return counts, weight_sums, weight_counts
+
+
+def polygon_totals(polygons, lons: np.ndarray, lats: np.ndarray, weights: np.ndarray):
+    # Per-polygon (count, weight_sum, weight_count) arrays; missing weights are skipped
+    order = morton_order(lons, lats)
+    lons = lons[order]
+    lats = lats[order]
+    weights = weights[order]
+
+    if polygon_totals_jit is None:
+        return pair_totals(polygons, lons, lats, weights)
+    # Compiled kernels spread points (fused) or polygons (candidates) across cores
+    fused = fused_totals_jit is not None and len(polygons) <= FUSED_MAX_POLYGONS
+    return kernel_totals(polygons, lons, lats, weights, fused)
+
+
+def parse_float_column(values: pd.Series) -> np.ndarray:
+    # Trim, drop a trailing "%" and parse; anything unparseable becomes NaN
+    cleaned = values.str.strip().str.removesuffix("%")
+    return pd.to_numeric(cleaned, errors="coerce").to_numpy(dtype=np.float64)
+
+
+def arrow_float_column(values) -> np.ndarray:
+    # Same rules as parse_float_column, computed on an Arrow string column
+    cleaned = pc.utf8_trim_whitespace(values)
+    cleaned = pc.replace_substring_regex(cleaned, pattern="%$", replacement="", max_replacements=1)
+    cleaned = pc.if_else(pc.equal(cleaned, ""), pa.scalar(None, pa.string()), cleaned)
+    try:
+        return pc.cast(cleaned, pa.float64()).to_numpy(zero_copy_only=False)
+    except pa.ArrowInvalid:
+        # Some value is not a number; coerce those to NaN
+        return pd.to_numeric(cleaned.to_pandas(), errors="coerce").to_numpy(dtype=np.float64)
+
+
+def read_float_columns(csv_path: str, usecols: List[str], read_opts: Dict) -> Dict[str, np.ndarray]:
+    # Multi-threaded Arrow parse when pyarrow is installed; files it rejects
+    # (ragged rows, invalid UTF-8) go through the pandas C parser instead
+    if pa is not None:
+        convert_options = pv.ConvertOptions(
+            include_columns=usecols,
+            column_types={name: pa.string() for name in usecols},
+            strings_can_be_null=False,
+        )
+        try:
+            table = pv.read_csv(csv_path, convert_options=convert_options)
+        except pa.ArrowException:
+            table = None
+        if table is not None:
+            return {name: arrow_float_column(table[name]) for name in usecols}
+
+    df = pd.read_csv(csv_path, usecols=usecols, engine="c", **read_opts)
+    return {name: parse_float_column(df[name]) for name in usecols}
+
+
+def load_points(csv_path: str, lat_col: str, lon_col: str, weight_col: Optional[str]):
+    read_opts = {"encoding": "utf-8", "encoding_errors": "replace", "dtype": str, "na_filter": False}
+    try:
+        fieldnames = list(pd.read_csv(csv_path, nrows=0, **read_opts).columns)
+    except pd.errors.EmptyDataError:
+        raise ValueError("CSV has no header row.")
+
+    field_map = {name.strip().lstrip("\ufeff").lower(): name for name in fieldnames}
+    lat_key = field_map.get(lat_col.lower())
+    lon_key = field_map.get(lon_col.lower())
+    weight_key = field_map.get(weight_col.lower()) if weight_col else None
+
+    if not lat_key or not lon_key:
+        raise ValueError(f"CSV missing columns. Found: {fieldnames}")
+
+    usecols = list(dict.fromkeys(k for k in (lat_key, lon_key, weight_key) if k))
+    columns = read_float_columns(csv_path, usecols, read_opts)
+    lats = columns[lat_key]
+    lons = columns[lon_key]
+    weights = columns[weight_key] if weight_key else np.full(lats.size, np.nan)
+
+    # Struct-of-arrays; rows without coordinates are dropped, missing weights are NaN
+    keep = ~(np.isnan(lats) | np.isnan(lons))
+    return lons[keep], lats[keep], weights[keep]